@@ -9,6 +9,7 @@ if __name__ == '__main__':
     cy_ext += [Extension(name='rbf.pde.halton', sources=['rbf/pde/halton.pyx'])]
     cy_ext += [Extension(name='rbf.pde.geometry', sources=['rbf/pde/geometry.pyx'])]
     cy_ext += [Extension(name='rbf.pde.sampling', sources=['rbf/pde/sampling.pyx'])]
+    cy_ext += [Extension(name='rbf.pde._fd_core', sources=['rbf/pde/_fd_core.pyx'])]
     ext = cythonize(cy_ext)
     for itm in ext:
         print('name=%s, sources=%s' % (itm.name, itm.sources))
@@ -0,0 +1,156 @@
+'''
+This module contains compiled kernels used by `rbf.pde.fd`
+'''
+import numpy as np
+
+from scipy.linalg.cython_lapack cimport dsytrf, dsytrs
+from cython cimport boundscheck, wraparound
+from libc.stdlib cimport malloc, free
+
+
+@boundscheck(False)
+@wraparound(False)
+def symmetric_factor(const double[:, :, ::1] A):
+    '''
+    Factors each symmetric system in `A` with the LAPACK routine DSYTRF, which
+    computes a Bunch-Kaufman LDL^T factorization. The factorizations can be
+    applied to right-hand-sides with `symmetric_solve`. The loop over the
+    systems does not hold the GIL, so it can be run in parallel threads.
+
+    Parameters
+    ----------
+    A : (K, M, M) float array
+        Symmetric systems. Only the upper triangle is used.
+
+    Returns
+    -------
+    fac : (K, M, M) float array
+        Factors of each system in the format returned by DSYTRF. Each (M, M)
+        block is stored in column-major order.
+
+    ipiv : (K, M) int array
+        Pivot indices for each system
+
+    Raises
+    ------
+    numpy.linalg.LinAlgError
+        If any of the systems are singular.
+
+    '''
+    if A.shape[1] != A.shape[2]:
+        raise ValueError('The systems in `A` must be square.')
+
+    # The lower triangle of `A` in column-major order is the upper triangle of
+    # `A` in row-major order, so each system can be factored in place
+    fac_array = np.array(A, dtype=float, order='C')
+    ipiv_array = np.empty((A.shape[0], A.shape[1]), dtype=np.intc)
+    cdef:
+        int k, info = 0, lwork
+        int nsys = A.shape[0]
+        int size = A.shape[1]
+        char uplo = b'L'
+        double query
+        double[:, :, ::1] fac = fac_array
+        int[:, ::1] ipiv = ipiv_array
+        double *work = NULL
+
+    if (nsys == 0) or (size == 0):
+        return fac_array, ipiv_array
+
+    # find the optimal workspace size
+    lwork = -1
+    dsytrf(&uplo, &size, &fac[0, 0, 0], &size, &ipiv[0, 0], &query, &lwork,
+           &info)
+    lwork = max(<int>query, 1)
+    work = <double *>malloc(lwork*sizeof(double))
+    if work == NULL:
+        raise MemoryError()
+
+    with nogil:
+        for k in range(nsys):
+            dsytrf(&uplo, &size, &fac[k, 0, 0], &size, &ipiv[k, 0], work,
+                   &lwork, &info)
+            if info != 0:
+                break
+
+    free(work)
+    if info > 0:
+        raise np.linalg.LinAlgError('Singular matrix')
+    elif info < 0:
+        raise ValueError('Illegal value in argument %d of DSYTRF' % -info)
+
+    return fac_array, ipiv_array
+
+
+@boundscheck(False)
+@wraparound(False)
+def symmetric_solve(const double[:, :, ::1] fac, const int[:, ::1] ipiv,
+                    const double[:, :, ::1] b):
+    '''
+    Solves each system factored by `symmetric_factor` for the corresponding
+    right-hand-sides in `b` with the LAPACK routine DSYTRS. This does not form
+    the inverse of the systems, so it is as accurate as solving the systems
+    directly. The loop over the systems does not hold the GIL.
+
+    Parameters
+    ----------
+    fac : (K, M, M) float array
+        Factors returned by `symmetric_factor`
+
+    ipiv : (K, M) int array
+        Pivot indices returned by `symmetric_factor`
+
+    b : (K, M, R) float array
+        Right-hand-sides
+
+    Returns
+    -------
+    (K, M, R) float array
+
+    '''
+    # the loop below does not check bounds, so the shapes must be consistent
+    if ((fac.shape[0] != b.shape[0]) or
+        (ipiv.shape[0] != b.shape[0]) or
+        (fac.shape[1] != b.shape[1]) or
+        (fac.shape[2] != b.shape[1]) or
+        (ipiv.shape[1] != b.shape[1])):
+        raise ValueError(
+            'The shapes of `fac`, `ipiv`, and `b` are inconsistent.'
+            )
+
+    out_array = np.empty((b.shape[0], b.shape[1], b.shape[2]), dtype=float)
+    cdef:
+        int i, j, k, info = 0
+        int nsys = b.shape[0]
+        int size = b.shape[1]
+        int nrhs = b.shape[2]
+        char uplo = b'L'
+        double[:, :, ::1] out = out_array
+        # LAPACK expects the right-hand-sides in column-major order
+        double *buf = <double *>malloc(max(size*nrhs, 1)*sizeof(double))
+
+    if buf == NULL:
+        raise MemoryError()
+
+    with nogil:
+        for k in range(nsys):
+            for i in range(size):
+                for j in range(nrhs):
+                    buf[j*size + i] = b[k, i, j]
+
+            # DSYTRS does not modify the factors or pivots, so it is safe to
+            # cast away the const qualifiers
+            dsytrs(&uplo, &size, &nrhs, <double *>&fac[k, 0, 0], &size,
+                   <int *>&ipiv[k, 0], buf, &size, &info)
+            if info != 0:
+                break
+
+            for i in range(size):
+                for j in range(nrhs):
+                    out[k, i, j] = buf[j*size + i]
+
+    free(buf)
+    if info < 0:
+        raise ValueError('Illegal value in argument %d of DSYTRS' % -info)
+
+    return out_array
@@ -0,0 +1,57 @@
+'''
+This module contains the CUDA functions used by `rbf.pde.fd` when
+`device='cuda'`. They require CuPy.
+'''
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cupy as cp
+    import cupyx
+    import cupyx.scipy.sparse as cpsp
+    HAS_CUPY = True
+except ImportError:
+    HAS_CUPY = False
+    CUPY_MSG = (
+        'Could not import cupy. RBF-FD weight matrices cannot be built with '
+        '`device="cuda"`.'
+        )
+    logger.debug(CUPY_MSG)
+
+
+def check_cupy():
+    '''
+    Raises an `ImportError` if CuPy is not available
+    '''
+    if not HAS_CUPY:
+        raise ImportError(CUPY_MSG)
+
+
+def to_device(a):
+    '''
+    Copies the numpy array `a` to the current CUDA device
+    '''
+    return cp.asarray(a)
+
+
+def empty(shape, dtype=float):
+    '''
+    Returns an uninitialized array on the current CUDA device
+    '''
+    return cp.empty(shape, dtype=dtype)
+
+
+def batched_solve(A, b):
+    '''
+    Solves the (K, M, M) systems `A` for the (K, M, R) arrays `b` on the
+    current CUDA device. `A` and `b` are copied to the device, and the
+    solution is returned as a cupy array. The systems are solved in one
+    batched LU factorization.
+    '''
+    A = cp.asarray(A)
+    b = cp.asarray(b)
+    with cupyx.errstate(linalg='raise'):
+        out = cp.linalg.solve(A, b)
+
+    return out
@@ -1,37 +1,177 @@
 '''
 This module contains functions for building two and three-dimensional weight
 matrices for linear elasticity problems.
+
+The stencils and RBF-FD systems can be cached by specifying `cache=True`, so
+that they are shared by calls with the same points and stencil size. This is
+useful when the matrices are rebuilt with different Lame parameters, but the
+cached arrays are kept in memory after the calls return (see
+`rbf.pde.fd.weight_matrix`). The matrices can be returned in single precision
+by specifying `dtype=np.float32`, and they can be built on a CUDA device by
+specifying `device='cuda'`, in which case they are `cupyx.scipy.sparse`
+matrices.
 '''
-from rbf.pde.fd import weight_matrix
+from itertools import accumulate
+
+import numpy as np
+import scipy.sparse as sp
+
+from rbf.basis import get_rbf
+from rbf.utils import assert_shape
+from rbf.pde import _fd_core_cuda
+from rbf.pde.fd import (
+    weight_matrix, _shared_weight_matrix, _array_modules, _pack_coeffs,
+    _resolve_order
+    )
+
+# The weight matrix for each component is the sum of the terms `start` to
+# `stop` in the operator passed to `_shared_weight_matrix`. These are the
+# component keys with their `start` and `stop` indices.
+_BODY_FORCE_2D_SLICES = (
+    ('xx', 0, 2), ('xy', 2, 3),
+    ('yx', 3, 4), ('yy', 4, 6)
+    )
+_SURFACE_FORCE_2D_SLICES = (
+    ('xx', 0, 2), ('xy', 2, 4),
+    ('yx', 4, 6), ('yy', 6, 8)
+    )
+_BODY_FORCE_3D_SLICES = (
+    ('xx', 0, 3), ('xy', 3, 4), ('xz', 4, 5),
+    ('yx', 5, 6), ('yy', 6, 9), ('yz', 9, 10),
+    ('zx', 10, 11), ('zy', 11, 12), ('zz', 12, 15)
+    )
+
+
+# The terms in the 3D surface force for each component. Each term is the
+# derivative order, the normal vector component that it is scaled by, and the
+# Lame parameter combination that it is scaled by ('l' for lamb, 'm' for mu,
+# and 'a' for lamb + 2*mu).
+_SURFACE_FORCE_3D_TERMS = (
+    ('xx', (((1, 0, 0), 0, 'a'), ((0, 1, 0), 1, 'm'), ((0, 0, 1), 2, 'm'))),
+    ('xy', (((0, 1, 0), 0, 'l'), ((1, 0, 0), 1, 'm'))),
+    ('xz', (((0, 0, 1), 0, 'l'), ((1, 0, 0), 2, 'm'))),
+    ('yx', (((0, 1, 0), 0, 'm'), ((1, 0, 0), 1, 'l'))),
+    ('yy', (((1, 0, 0), 0, 'm'), ((0, 1, 0), 1, 'a'), ((0, 0, 1), 2, 'm'))),
+    ('yz', (((0, 0, 1), 1, 'l'), ((0, 1, 0), 2, 'm'))),
+    ('zx', (((0, 0, 1), 0, 'm'), ((1, 0, 0), 2, 'l'))),
+    ('zy', (((0, 0, 1), 1, 'm'), ((0, 1, 0), 2, 'l'))),
+    ('zz', (((1, 0, 0), 0, 'm'), ((0, 1, 0), 1, 'm'), ((0, 0, 1), 2, 'a')))
+    )
+# the slices are derived from the number of terms for each component, so that
+# they cannot get out of sync with `_SURFACE_FORCE_3D_TERMS`
+_SURFACE_FORCE_3D_SLICES = tuple(
+    (key, stop - len(comp), stop)
+    for (key, comp), stop in zip(
+        _SURFACE_FORCE_3D_TERMS,
+        accumulate(len(comp) for _, comp in _SURFACE_FORCE_3D_TERMS)
+        )
+    )
 
-def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
+
+def _slice_groups(slices):
     '''
-    Returns weight matrices that map displacements at `p` to the body force at
-    `x` in a two-dimensional (plane strain) homogeneous elastic medium
+    Returns the groups of terms that are summed for each component in
+    `slices`, which are passed to `_shared_weight_matrix` as `sum_groups`
+    '''
+    return [range(start, stop) for _, start, stop in slices]
 
-    Parameters
-    ----------
-    x : (N, 2) array
-        Target points.
 
-    p : (M, 2) array
-        Observation points.
+def _component_dict(Ds, slices, sums_as_csr=False):
+    '''
+    Returns a dictionary with a sparse matrix for each component in
+    `slices`, where `Ds` contains the weight matrices for the components in
+    the same order. The matrices are in COO format, like the output of
+    `weight_matrix`, and they share one pair of row and column index arrays.
+    If `sums_as_csr` is True, then the components with more than one term are
+    instead CSR matrices with their own index arrays, which is what adding
+    the COO matrices for each term used to return.
+    '''
+    xp, xsp = _array_modules(Ds.data)
+    nx = Ds.shape[0]
+    # every row has the same number of entries
+    n = Ds.indices.size // nx if nx else 0
+    rows = xp.repeat(xp.arange(nx), n)
+    cols = Ds.indices
+    out = {}
+    for (key, start, stop), data in zip(slices, Ds.data):
+        if sums_as_csr and (stop - start > 1):
+            out[key] = xsp.csr_matrix(
+                (data, Ds.indices.copy(), Ds.indptr.copy()), shape=Ds.shape
+                )
+        else:
+            out[key] = xsp.coo_matrix((data, (rows, cols)), shape=Ds.shape)
 
-    n : int
-        stencil size
+    return out
 
-    lamb, mu : float, optional
-        Lame parameters
 
-    **kwargs :
-        additional arguments passed to `weight_matrix`
+def _block_csr(Ds, slices, dim):
+    '''
+    Returns a single (dim*N, dim*M) CSR matrix, where the (i, j) block is the
+    weight matrix in `Ds` for the component in `slices` with key
+    `'xyz'[i] + 'xyz'[j]`. The data and indices are written directly into the
+    CSR arrays, rather than building each component and then stacking them.
+    '''
+    xp, xsp = _array_modules(Ds.data)
+    nx, nobs = Ds.shape
+    # each row has the same number of entries, `n`, for every term
+    stencils = Ds.indices.reshape(nx, -1)
+    n = stencils.shape[1]
+    data = xp.empty((dim, nx, dim, n), dtype=Ds.data.dtype)
+    indices = xp.empty((dim, nx, dim, n), dtype=stencils.dtype)
+    for (key, _, _), Ds_data in zip(slices, Ds.data):
+        i, j = 'xyz'.index(key[0]), 'xyz'.index(key[1])
+        data[i, :, j] = Ds_data.reshape(nx, n)
+        indices[i, :, j] = stencils + j*nobs
+
+    indptr = xp.arange(0, dim*nx*dim*n + 1, dim*n)
+    out = xsp.csr_matrix(
+        (data.ravel(), indices.ravel(), indptr),
+        shape=(dim*nx, dim*nobs)
+        )
+    return out
 
-    Returns
-    -------
-    dict
-        keys are the components and the values are the corresponding weight
-        matrices.
 
+def _displacement_identity(x, p, n, phi='phs3', order=None, eps=1.0,
+                           sum_terms=True, sum_groups=None, chunk_size=1000,
+                           cache=False, workers=1, dtype=float, device='cpu'):
+    '''
+    Returns an identity matrix if `x` and `p` are the same points and `None`
+    otherwise. Each point in `x` is then in its own stencil, and the RBF-FD
+    interpolation weights are one for that point and zero for the rest, so
+    the stencils do not need to be built. The arguments are the same as for
+    `weight_matrix`, and they are checked in the same way even though most of
+    them do not change the identity matrix.
+    '''
+    if (x is not p) and not np.array_equal(x, p):
+        return None
+
+    if device == 'cuda':
+        _fd_core_cuda.check_cupy()
+        xsp = _fd_core_cuda.cpsp
+    elif device == 'cpu':
+        xsp = sp
+    else:
+        raise ValueError('`device` must be "cpu" or "cuda".')
+
+    p = np.asarray(p, dtype=float)
+    assert_shape(p, (None, None), 'p')
+    nobs, ndim = p.shape
+    if n > nobs:
+        raise ValueError(
+            'Cannot find the %s nearest points among a set of %s points'
+            % (n, nobs))
+
+    get_rbf(phi)
+    _resolve_order(order, np.zeros((1, ndim), dtype=int), n, ndim)
+
+    out = xsp.eye(nobs, dtype=dtype, format='coo')
+    return out
+
+
+def _elastic2d_body_force_components(x, p, n, lamb, mu, **kwargs):
+    '''
+    Returns the weight matrices for each component in
+    `elastic2d_body_force` as a `_SharedCSR`
     '''
     # x component of force resulting from displacement in the x direction.
     coeffs_xx = [lamb + 2*mu, mu]
@@ -47,20 +187,17 @@ def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_yy =  [(0, 2), (2, 0)]
     # make the differentiation matrices that enforce the PDE on the interior
     # nodes.
-    diffs = diffs_xx + diffs_xy + diffs_yx + diffs_yy
-    coeffs = coeffs_xx + coeffs_xy + coeffs_yx + coeffs_yy
-    Ds = weight_matrix(
-        x, p, n, diffs, coeffs=coeffs, sum_terms=False, **kwargs
+    # pack the terms into a (K, 2) array of derivatives and a (K,) or (K, N)
+    # array of coefficients
+    diffs = np.array((*diffs_xx, *diffs_xy, *diffs_yx, *diffs_yy), dtype=int)
+    coeffs = _pack_coeffs((*coeffs_xx, *coeffs_xy, *coeffs_yx, *coeffs_yy))
+    Ds = _shared_weight_matrix(
+        x, p, n, diffs, coeffs=coeffs,
+        sum_groups=_slice_groups(_BODY_FORCE_2D_SLICES),
+        **kwargs
         )
 
-    out = {
-        'xx': Ds[0] + Ds[1],
-        'xy': Ds[2],
-        'yx': Ds[3],
-        'yy': Ds[4] + Ds[5]
-        }
-
-    return out
+    return Ds
 
     # The above should be equivalent to:
     #D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
@@ -69,30 +206,27 @@ def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     #D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
     #return {'xx':D_xx, 'xy':D_xy, 'yx':D_yx, 'yy':D_yy}
 
-def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
+
+def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     '''
-    Returns weight matrices that map displacements at `p` to the surface
-    traction force at `x` with normals `nrm` in a two-dimensional (plane
-    strain) homogeneous elastic medium.
+    Returns weight matrices that map displacements at `p` to the body force at
+    `x` in a two-dimensional (plane strain) homogeneous elastic medium
 
     Parameters
     ----------
-    x: (N, 2) array
-        target points which reside on a surface.
-
-    nrm: (N, 2) array
-        surface normal vectors at each point in `x`.
+    x : (N, 2) array
+        Target points.
 
-    p: (M, 2) array
-        observation points.
+    p : (M, 2) array
+        Observation points.
 
     n : int
         stencil size
 
-    lamb, mu: float
+    lamb, mu : float, optional
         Lame parameters
 
-    **kwargs:
+    **kwargs :
         additional arguments passed to `weight_matrix`
 
     Returns
@@ -102,33 +236,83 @@ def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
         matrices.
 
     '''
+    Ds = _elastic2d_body_force_components(x, p, n, lamb=lamb, mu=mu, **kwargs)
+    out = _component_dict(Ds, _BODY_FORCE_2D_SLICES, sums_as_csr=True)
+    return out
+
+
+def elastic2d_body_force_block(x, p, n, lamb=1.0, mu=1.0, **kwargs):
+    '''
+    Returns a single weight matrix that maps displacements at `p` to the body
+    force at `x`. This is the same as stacking the components returned by
+    `elastic2d_body_force` into a block matrix, but it is built without the
+    intermediate component matrices.
+
+    Parameters
+    ----------
+    x : (N, 2) array
+        Target points.
+
+    p : (M, 2) array
+        Observation points.
+
+    n : int
+        stencil size
+
+    lamb, mu : float, optional
+        Lame parameters
+
+    **kwargs :
+        additional arguments passed to `weight_matrix`
+
+    Returns
+    -------
+    (2N, 2M) csr sparse matrix
+        The rows are ordered by force component and then by target point. The
+        columns are ordered by displacement component and then by observation
+        point.
+
+    '''
+    Ds = _elastic2d_body_force_components(x, p, n, lamb=lamb, mu=mu, **kwargs)
+    out = _block_csr(Ds, _BODY_FORCE_2D_SLICES, 2)
+    return out
+
+
+def _elastic2d_surface_force_components(x, nrm, p, n, lamb, mu, **kwargs):
+    '''
+    Returns the weight matrices for each component in
+    `elastic2d_surface_force` as a `_SharedCSR`
+    '''
+    # compute the products of the normal vector components and the Lame
+    # parameters once, since most of them are used for multiple terms
+    nrm_x, nrm_y = nrm[:, 0], nrm[:, 1]
+    nrm_x_lamb, nrm_y_lamb = nrm_x*lamb, nrm_y*lamb
+    nrm_x_mu, nrm_y_mu = nrm_x*mu, nrm_y*mu
+    nrm_x_lamb_2mu, nrm_y_lamb_2mu = nrm_x*(lamb + 2*mu), nrm_y*(lamb + 2*mu)
     # x component of traction force resulting from x displacement
-    coeffs_xx = [nrm[:, 0]*(lamb + 2*mu), nrm[:, 1]*mu]
+    coeffs_xx = [nrm_x_lamb_2mu, nrm_y_mu]
     diffs_xx =  [(1, 0), (0, 1)]
     # x component of traction force resulting from y displacement
-    coeffs_xy = [nrm[:, 0]*lamb, nrm[:, 1]*mu]
+    coeffs_xy = [nrm_x_lamb, nrm_y_mu]
     diffs_xy =  [(0, 1), (1, 0)]
     # y component of traction force resulting from x displacement
-    coeffs_yx = [nrm[:, 0]*mu, nrm[:, 1]*lamb]
+    coeffs_yx = [nrm_x_mu, nrm_y_lamb]
     diffs_yx =  [(0, 1), (1, 0)]
     # y component of force resulting from displacement in the y direction
-    coeffs_yy = [nrm[:, 0]*mu, nrm[:, 1]*(lamb + 2*mu)]
+    coeffs_yy = [nrm_x_mu, nrm_y_lamb_2mu]
     diffs_yy =  [(1, 0), (0, 1)]
 
-    diffs = diffs_xx + diffs_xy + diffs_yx + diffs_yy
-    coeffs = coeffs_xx + coeffs_xy + coeffs_yx + coeffs_yy
-    Ds = weight_matrix(
-        x, p, n, diffs, coeffs=coeffs, sum_terms=False, **kwargs
+    # pack the terms into a (K, 2) array of derivatives and a (K,) or (K, N)
+    # array of coefficients
+    diffs = np.array((*diffs_xx, *diffs_xy, *diffs_yx, *diffs_yy), dtype=int)
+    coeffs = _pack_coeffs((*coeffs_xx, *coeffs_xy, *coeffs_yx, *coeffs_yy))
+    Ds = _shared_weight_matrix(
+        x, p, n, diffs, coeffs=coeffs,
+        sum_groups=_slice_groups(_SURFACE_FORCE_2D_SLICES),
+        **kwargs
         )
 
-    out = {
-        'xx': Ds[0] + Ds[1],
-        'xy': Ds[2] + Ds[3],
-        'yx': Ds[4] + Ds[5],
-        'yy': Ds[6] + Ds[7]
-        }
-
-    return out
+    return Ds
 
     # make the differentiation matrices that enforce the free surface boundary
     # conditions.
@@ -139,15 +323,19 @@ def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
     #return {'xx':D_xx, 'xy':D_xy, 'yx':D_yx, 'yy':D_yy}
 
 
-def elastic2d_displacement(x, p, n, **kwargs):
+def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
     '''
-    Returns weight matrices that map displacements at `p` to the displacements
-    at `x`.
+    Returns weight matrices that map displacements at `p` to the surface
+    traction force at `x` with normals `nrm` in a two-dimensional (plane
+    strain) homogeneous elastic medium.
 
     Parameters
     ----------
     x: (N, 2) array
-        target points.
+        target points which reside on a surface.
+
+    nrm: (N, 2) array
+        surface normal vectors at each point in `x`.
 
     p: (M, 2) array
         observation points.
@@ -155,6 +343,9 @@ def elastic2d_displacement(x, p, n, **kwargs):
     n : int
         stencil size
 
+    lamb, mu: float
+        Lame parameters
+
     **kwargs:
         additional arguments passed to `weight_matrix`
 
@@ -165,30 +356,71 @@ def elastic2d_displacement(x, p, n, **kwargs):
         matrices.
 
     '''
-    D_xx = weight_matrix(x, p, n, (0, 0), **kwargs)
-    D_yy = weight_matrix(x, p, n, (0, 0), **kwargs)
-    return {'xx':D_xx, 'yy':D_yy}
+    Ds = _elastic2d_surface_force_components(
+        x, nrm, p, n, lamb=lamb, mu=mu, **kwargs
+        )
+    out = _component_dict(Ds, _SURFACE_FORCE_2D_SLICES, sums_as_csr=True)
+    return out
 
 
-def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
+def elastic2d_surface_force_block(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
     '''
-    Returns weight matrices that map displacements at `p` to the body force at
-    `x` in a three-dimensional homogeneous elastic medium.
+    Returns a single weight matrix that maps displacements at `p` to the
+    surface traction force at `x`. This is the same as stacking the components
+    returned by `elastic2d_surface_force` into a block matrix, but it is built
+    without the intermediate component matrices.
 
     Parameters
     ----------
-    x: (N, 3) array
+    x : (N, 2) array
+        Target points which reside on a surface.
+
+    nrm : (N, 2) array
+        Surface normal vectors at each point in `x`.
+
+    p : (M, 2) array
+        Observation points.
+
+    n : int
+        stencil size
+
+    lamb, mu : float, optional
+        Lame parameters
+
+    **kwargs :
+        additional arguments passed to `weight_matrix`
+
+    Returns
+    -------
+    (2N, 2M) csr sparse matrix
+        The rows are ordered by force component and then by target point. The
+        columns are ordered by displacement component and then by observation
+        point.
+
+    '''
+    Ds = _elastic2d_surface_force_components(
+        x, nrm, p, n, lamb=lamb, mu=mu, **kwargs
+        )
+    out = _block_csr(Ds, _SURFACE_FORCE_2D_SLICES, 2)
+    return out
+
+
+def elastic2d_displacement(x, p, n, **kwargs):
+    '''
+    Returns weight matrices that map displacements at `p` to the displacements
+    at `x`.
+
+    Parameters
+    ----------
+    x: (N, 2) array
         target points.
 
-    p: (M, 3) array
+    p: (M, 2) array
         observation points.
 
     n : int
         stencil size
 
-    lamb, mu: float
-        first Lame parameter
-
     **kwargs:
         additional arguments passed to `weight_matrix`
 
@@ -196,8 +428,24 @@ def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     -------
     dict
         keys are the components and the values are the corresponding weight
-        matrices.
+        matrices. The matrices are computed once and then copied for each
+        component, so they can be modified independently. If `x` and `p` are
+        the same points, then the matrices are identity matrices.
+
+    '''
+    # the weight matrix is the same for each component, so it only needs to be
+    # computed once
+    D = _displacement_identity(x, p, n, **kwargs)
+    if D is None:
+        D = weight_matrix(x, p, n, (0, 0), **kwargs)
+
+    return {'xx':D, 'yy':D.copy()}
 
+
+def _elastic3d_body_force_components(x, p, n, lamb, mu, **kwargs):
+    '''
+    Returns the weight matrices for each component in
+    `elastic3d_body_force` as a `_SharedCSR`
     '''
     coeffs_xx = [lamb + 2*mu, mu, mu]
     diffs_xx =  [(2, 0, 0), (0, 2, 0), (0, 0, 2)]
@@ -217,18 +465,117 @@ def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_zy =  [(0, 1, 1)]
     coeffs_zz = [mu, mu, lamb + 2*mu]
     diffs_zz =  [(2, 0, 0), (0, 2, 0), (0, 0, 2)]
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_xz = weight_matrix(x, p, n, diffs_xz, coeffs=coeffs_xz, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
-    D_yz = weight_matrix(x, p, n, diffs_yz, coeffs=coeffs_yz, **kwargs)
-    D_zx = weight_matrix(x, p, n, diffs_zx, coeffs=coeffs_zx, **kwargs)
-    D_zy = weight_matrix(x, p, n, diffs_zy, coeffs=coeffs_zy, **kwargs)
-    D_zz = weight_matrix(x, p, n, diffs_zz, coeffs=coeffs_zz, **kwargs)
-    return {'xx':D_xx, 'xy':D_xy, 'xz':D_xz,
-            'yx':D_yx, 'yy':D_yy, 'yz':D_yz,
-            'zx':D_zx, 'zy':D_zy, 'zz':D_zz}
+    # pack the terms into a (K, 3) array of derivatives and a (K,) or (K, N)
+    # array of coefficients
+    diffs = np.array((*diffs_xx, *diffs_xy, *diffs_xz,
+                      *diffs_yx, *diffs_yy, *diffs_yz,
+                      *diffs_zx, *diffs_zy, *diffs_zz), dtype=int)
+    coeffs = _pack_coeffs((*coeffs_xx, *coeffs_xy, *coeffs_xz,
+                           *coeffs_yx, *coeffs_yy, *coeffs_yz,
+                           *coeffs_zx, *coeffs_zy, *coeffs_zz))
+    Ds = _shared_weight_matrix(
+        x, p, n, diffs, coeffs=coeffs,
+        sum_groups=_slice_groups(_BODY_FORCE_3D_SLICES),
+        **kwargs
+        )
+
+    return Ds
+
+
+def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
+    '''
+    Returns weight matrices that map displacements at `p` to the body force at
+    `x` in a three-dimensional homogeneous elastic medium.
+
+    Parameters
+    ----------
+    x: (N, 3) array
+        target points.
+
+    p: (M, 3) array
+        observation points.
+
+    n : int
+        stencil size
+
+    lamb, mu: float
+        first Lame parameter
+
+    **kwargs:
+        additional arguments passed to `weight_matrix`
+
+    Returns
+    -------
+    dict
+        keys are the components and the values are the corresponding weight
+        matrices.
+
+    '''
+    Ds = _elastic3d_body_force_components(x, p, n, lamb=lamb, mu=mu, **kwargs)
+    out = _component_dict(Ds, _BODY_FORCE_3D_SLICES)
+    return out
+
+
+def elastic3d_body_force_block(x, p, n, lamb=1.0, mu=1.0, **kwargs):
+    '''
+    Returns a single weight matrix that maps displacements at `p` to the body
+    force at `x`. This is the same as stacking the components returned by
+    `elastic3d_body_force` into a block matrix, but it is built without the
+    intermediate component matrices.
+
+    Parameters
+    ----------
+    x : (N, 3) array
+        Target points.
+
+    p : (M, 3) array
+        Observation points.
+
+    n : int
+        stencil size
+
+    lamb, mu : float, optional
+        Lame parameters
+
+    **kwargs :
+        additional arguments passed to `weight_matrix`
+
+    Returns
+    -------
+    (3N, 3M) csr sparse matrix
+        The rows are ordered by force component and then by target point. The
+        columns are ordered by displacement component and then by observation
+        point.
+
+    '''
+    Ds = _elastic3d_body_force_components(x, p, n, lamb=lamb, mu=mu, **kwargs)
+    out = _block_csr(Ds, _BODY_FORCE_3D_SLICES, 3)
+    return out
+
+
+def _elastic3d_surface_force_components(x, nrm, p, n, lamb, mu, **kwargs):
+    '''
+    Returns the weight matrices for each component in
+    `elastic3d_surface_force` as a `_SharedCSR`
+    '''
+    nrm = np.asarray(nrm, dtype=float)
+    # Lame parameter combination for each term
+    scales = {'l': lamb, 'm': mu, 'a': lamb + 2*mu}
+    terms = [t for _, comp in _SURFACE_FORCE_3D_TERMS for t in comp]
+    diffs, dirs, params = zip(*terms)
+    diffs = np.array(diffs, dtype=int)
+    # the Lame parameters may vary between the target points, so `scale` is
+    # either a (K,) or (K, N) array
+    scale = _pack_coeffs([scales[c] for c in params])
+    # build the (K, N) coefficients for all the terms at once
+    coeffs = nrm[:, list(dirs)].T*scale.reshape(len(params), -1)
+    Ds = _shared_weight_matrix(
+        x, p, n, diffs, coeffs=coeffs,
+        sum_groups=_slice_groups(_SURFACE_FORCE_3D_SLICES),
+        **kwargs
+        )
+
+    return Ds
 
 
 def elastic3d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
@@ -264,36 +611,53 @@ def elastic3d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
         matrices.
 
     '''
-    coeffs_xx = [nrm[:, 0]*(lamb + 2*mu), nrm[:, 1]*mu, nrm[:, 2]*mu]
-    diffs_xx =  [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
-    coeffs_xy = [nrm[:, 0]*lamb, nrm[:, 1]*mu]
-    diffs_xy =  [(0, 1, 0), (1, 0, 0)]
-    coeffs_xz = [nrm[:, 0]*lamb, nrm[:, 2]*mu]
-    diffs_xz =  [(0, 0, 1), (1, 0, 0)]
-    coeffs_yx = [nrm[:, 0]*mu, nrm[:, 1]*lamb]
-    diffs_yx =  [(0, 1, 0), (1, 0, 0)]
-    coeffs_yy = [nrm[:, 0]*mu, nrm[:, 1]*(lamb + 2*mu), nrm[:, 2]*mu]
-    diffs_yy =  [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
-    coeffs_yz = [nrm[:, 1]*lamb, nrm[:, 2]*mu]
-    diffs_yz =  [(0, 0, 1), (0, 1, 0)]
-    coeffs_zx = [nrm[:, 0]*mu, nrm[:, 2]*lamb]
-    diffs_zx =  [(0, 0, 1), (1, 0, 0)]
-    coeffs_zy = [nrm[:, 1]*mu, nrm[:, 2]*lamb]
-    diffs_zy =  [(0, 0, 1), (0, 1, 0)]
-    coeffs_zz = [nrm[:, 0]*mu, nrm[:, 1]*mu, nrm[:, 2]*(lamb + 2*mu)]
-    diffs_zz =  [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_xz = weight_matrix(x, p, n, diffs_xz, coeffs=coeffs_xz, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
-    D_yz = weight_matrix(x, p, n, diffs_yz, coeffs=coeffs_yz, **kwargs)
-    D_zx = weight_matrix(x, p, n, diffs_zx, coeffs=coeffs_zx, **kwargs)
-    D_zy = weight_matrix(x, p, n, diffs_zy, coeffs=coeffs_zy, **kwargs)
-    D_zz = weight_matrix(x, p, n, diffs_zz, coeffs=coeffs_zz, **kwargs)
-    return {'xx':D_xx, 'xy':D_xy, 'xz':D_xz,
-            'yx':D_yx, 'yy':D_yy, 'yz':D_yz,
-            'zx':D_zx, 'zy':D_zy, 'zz':D_zz}
+    Ds = _elastic3d_surface_force_components(
+        x, nrm, p, n, lamb=lamb, mu=mu, **kwargs
+        )
+    out = _component_dict(Ds, _SURFACE_FORCE_3D_SLICES)
+    return out
+
+
+def elastic3d_surface_force_block(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
+    '''
+    Returns a single weight matrix that maps displacements at `p` to the
+    surface traction force at `x`. This is the same as stacking the components
+    returned by `elastic3d_surface_force` into a block matrix, but it is built
+    without the intermediate component matrices.
+
+    Parameters
+    ----------
+    x : (N, 3) array
+        Target points which reside on a surface.
+
+    nrm : (N, 3) array
+        Surface normal vectors at each point in `x`.
+
+    p : (M, 3) array
+        Observation points.
+
+    n : int
+        stencil size
+
+    lamb, mu : float, optional
+        Lame parameters
+
+    **kwargs :
+        additional arguments passed to `weight_matrix`
+
+    Returns
+    -------
+    (3N, 3M) csr sparse matrix
+        The rows are ordered by force component and then by target point. The
+        columns are ordered by displacement component and then by observation
+        point.
+
+    '''
+    Ds = _elastic3d_surface_force_components(
+        x, nrm, p, n, lamb=lamb, mu=mu, **kwargs
+        )
+    out = _block_csr(Ds, _SURFACE_FORCE_3D_SLICES, 3)
+    return out
 
 
 def elastic3d_displacement(x, p, n, **kwargs):
@@ -319,10 +683,15 @@ def elastic3d_displacement(x, p, n, **kwargs):
     -------
     dict
         keys are the components and the values are the corresponding weight
-        matrices.
+        matrices. The matrices are computed once and then copied for each
+        component, so they can be modified independently. If `x` and `p` are
+        the same points, then the matrices are identity matrices.
 
     '''
-    D_xx = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
-    D_yy = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
-    D_zz = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
-    return {'xx':D_xx, 'yy':D_yy, 'zz':D_zz}
+    # the weight matrix is the same for each component, so it only needs to be
+    # computed once
+    D = _displacement_identity(x, p, n, **kwargs)
+    if D is None:
+        D = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
+
+    return {'xx':D, 'yy':D.copy(), 'zz':D.copy()}
@@ -3,15 +3,20 @@ This module provides functions for generating RBF-FD weights
 '''
 from __future__ import division
 from functools import lru_cache
+from collections import namedtuple
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import scipy.sparse as sp
 
 from rbf.basis import phs3, get_rbf
 from rbf.poly import monomial_count, monomial_powers, mvmonos
-from rbf.utils import assert_shape, KDTree
+from rbf.utils import assert_shape, KDTree, Memoize
 from rbf.linalg import as_array
+from rbf.pde._fd_core import symmetric_factor, symmetric_solve
+from rbf.pde import _fd_core_cuda
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +34,94 @@ def _max_poly_order(size, dim):
     return order
 
 
+def _resolve_order(order, diffs, size, dim):
+    '''
+    Returns the order of the added polynomial, which defaults to the highest
+    derivative order in `diffs` if `order` is None
+    '''
+    # get the maximum polynomial order allowed for this stencil size
+    max_order = _max_poly_order(size, dim)
+    if order is None:
+        # If the polynomial order is not specified, make it equal to the
+        # derivative order, provided that the stencil size is large enough.
+        order = diffs.sum(axis=1).max()
+        order = min(order, max_order)
+
+    if order > max_order:
+        raise ValueError('Polynomial order is too high for the stencil size')
+
+    return order
+
+
+def _lhs(s, phi, pwr, eps):
+    '''
+    Returns the left-hand-side of the RBF-FD system for the stencils `s`,
+    which should be centered on their target points
+    '''
+    nmonos = pwr.shape[0]
+    # evaluate the RBF and monomials at each point in the stencil
+    A = phi(s, s, eps=eps)
+    P = mvmonos(s, pwr)
+    Pt = P.swapaxes(-2, -1)
+    Z = np.zeros((*s.shape[:-2], nmonos, nmonos), dtype=float)
+    LHS = np.block([[A, P], [Pt, Z]])
+    return LHS
+
+
+def _rhs(s, phi, pwr, eps, diffs):
+    '''
+    Returns the right-hand-side of the RBF-FD system for the stencils `s`,
+    which should be centered on their target points. The last axis
+    corresponds to the terms in `diffs`
+    '''
+    ssize, ndim = s.shape[-2:]
+    nmonos = pwr.shape[0]
+    nterms = diffs.shape[0]
+    # the target points are at the origin after centering the stencils
+    x = np.zeros((*s.shape[:-2], 1, ndim), dtype=float)
+    # Evaluate the RBF and monomials at the target points for each term in the
+    # differential operator.
+    a = np.empty((*s.shape[:-2], ssize, nterms))
+    p = np.empty((*s.shape[:-2], nmonos, nterms))
+    for i in range(nterms):
+        # convert to an array because phi may be a sparse RBF
+        a[..., i] = as_array(phi(x, s, eps=eps, diff=diffs[i]))[..., 0, :]
+        p[..., i] = mvmonos(x, pwr, diff=diffs[i])[..., 0, :]
+
+    rhs = np.concatenate((a, p), axis=-2)
+    return rhs
+
+
+def _batched_solve(A, b):
+    '''
+    Solves the symmetric (..., M, M) systems `A` for the (..., M, R) arrays
+    `b`. The systems are solved with the compiled LDL^T kernels in
+    `rbf.pde._fd_core`, which do not hold the GIL.
+    '''
+    bcast = np.broadcast_shapes(A.shape[:-2], b.shape[:-2])
+    A = np.broadcast_to(A, bcast + A.shape[-2:])
+    b = np.broadcast_to(b, bcast + b.shape[-2:])
+    A = np.ascontiguousarray(A, dtype=float).reshape((-1,) + A.shape[-2:])
+    b = np.ascontiguousarray(b, dtype=float).reshape((-1,) + b.shape[-2:])
+    fac, ipiv = symmetric_factor(A)
+    out = symmetric_solve(fac, ipiv, b)
+    return out.reshape(bcast + out.shape[-2:])
+
+
+def _pack_coeffs(coeffs):
+    '''
+    Returns the coefficients for each term as a (K,) or (K, ...) float array.
+    `coeffs` can be an array, which is returned without copying if it is
+    already a float array, or a sequence with a scalar or an array for each
+    term, which are broadcast against each other.
+    '''
+    if isinstance(coeffs, np.ndarray):
+        return coeffs.astype(float, copy=False)
+
+    coeffs = [np.asarray(c, dtype=float) for c in coeffs]
+    return np.array(np.broadcast_arrays(*coeffs))
+
+
 def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0,
             sum_terms=True):
     '''
@@ -54,8 +147,9 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0,
 
     coeffs : (K, ...) float array, optional
         Coefficients for each term in the differential operator specified with
-        `diffs`. The coefficients can vary between target points. Defaults to
-        an array of ones.
+        `diffs`. The coefficients can vary between target points. This can
+        also be a sequence with a scalar or an array for each term. Defaults
+        to an array of ones.
 
     phi : rbf.basis.RBF instance or str, optional
         Type of RBF. See `rbf.basis` for the available options.
@@ -120,7 +214,7 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0,
     if coeffs is None:
         coeffs = np.ones(nterms, dtype=float)
     else:
-        coeffs = np.asarray(coeffs, dtype=float)
+        coeffs = _pack_coeffs(coeffs)
         assert_shape(coeffs, (nterms, ...), 'coeffs')
 
     bcast = np.broadcast_shapes(x.shape[:-1], s.shape[:-2], coeffs.shape[1:])
@@ -128,47 +222,19 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0,
     s = np.broadcast_to(s, bcast + s.shape[-2:])
 
     phi = get_rbf(phi)
-    # get the maximum polynomial order allowed for this stencil size
-    max_order = _max_poly_order(ssize, ndim)
-    if order is None:
-        # If the polynomial order is not specified, make it equal to the
-        # derivative order, provided that the stencil size is large enough.
-        order = diffs.sum(axis=1).max()
-        order = min(order, max_order)
-
-    if order > max_order:
-        raise ValueError('Polynomial order is too high for the stencil size')
-
+    order = _resolve_order(order, diffs, ssize, ndim)
     # center the stencil on `x` for improved numerical stability
-    x = x[..., None, :]
-    s = s - x
-    x = np.zeros_like(x)
+    s = s - x[..., None, :]
     # get the powers for the added monomials
     pwr = monomial_powers(order, ndim)
-    nmonos = pwr.shape[0]
-    # evaluate the RBF and monomials at each point in the stencil. This becomes
-    # the left-hand-side
-    A = phi(s, s, eps=eps)
-    P = mvmonos(s, pwr)
-    Pt = P.swapaxes(-2, -1)
-    Z = np.zeros((*bcast, nmonos, nmonos), dtype=float)
-    LHS = np.block([[A, P], [Pt, Z]])
-    # Evaluate the RBF and monomials at the target points for each term in the
-    # differential operator. This becomes the right-hand-side.
-    a = np.empty((*bcast, ssize, nterms))
-    p = np.empty((*bcast, nmonos, nterms))
-    for i in range(nterms):
-        # convert to an array because phi may be a sparse RBF
-        a[..., i] = as_array(phi(x, s, eps=eps, diff=diffs[i]))[..., 0, :]
-        p[..., i] = mvmonos(x, pwr, diff=diffs[i])[..., 0, :]
-
+    LHS = _lhs(s, phi, pwr, eps)
+    rhs = _rhs(s, phi, pwr, eps, diffs)
     coeffs = np.moveaxis(coeffs, 0, -1)[..., None, :]
-    rhs = np.concatenate((a, p), axis=-2)
     rhs *= coeffs
     if sum_terms:
         rhs = rhs.sum(axis=-1, keepdims=True)
 
-    w = np.linalg.solve(LHS, rhs)[..., :ssize, :]
+    w = _batched_solve(LHS, rhs)[..., :ssize, :]
     if sum_terms:
         w = w[..., 0]
     else:
@@ -176,13 +242,388 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0,
 
     return w
 
+
+class _MemoizeFD(Memoize):
+    '''
+    Memoizing decorator for the cached RBF-FD computations. Arrays are
+    identified by their content and the remaining positional arguments must
+    be hashable. Keyword arguments are passed to the function but are not
+    part of the key, so they should only control how the output is computed,
+    such as the chunk size and number of threads. Only a few outputs are kept
+    since each one can be large.
+    '''
+    _MAXSIZE = 4
+
+    def __call__(self, *args, **options):
+        key = self._as_key(args)
+        if key in self.cache:
+            # move the item to the end signifying that it was most recently
+            # used
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        if len(self.cache) == self._MAXSIZE:
+            # remove the first item which is the least recently used item
+            self.cache.popitem(last=False)
+
+        value = self.fin(*args, **options)
+        self.cache[key] = value
+        return value
+
+    @staticmethod
+    def _as_key(args):
+        key = tuple(
+            (a.tobytes(), a.shape, a.dtype) if isinstance(a, np.ndarray) else a
+            for a in args
+            )
+        return key
+
+
+def _map_chunks(func, size, chunk_size, workers):
+    '''
+    Calls `func(start, stop)` for each chunk of `size` items. If `workers` is
+    not 1, the chunks are evaluated in parallel with that many threads, which
+    is effective because the numerical work releases the GIL. `func` should
+    write its output to a preallocated array.
+    '''
+    if chunk_size is None:
+        chunk_size = max(size, 1)
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    starts = range(0, size, chunk_size)
+    if (workers == 1) or (len(starts) <= 1):
+        for start in starts:
+            func(start, start + chunk_size)
+
+    else:
+        # Evaluate the first chunk in this thread. This compiles any RBF
+        # derivatives that are needed, which is not safe to do concurrently.
+        func(starts[0], starts[0] + chunk_size)
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(func, start, start + chunk_size)
+                for start in starts[1:]
+                ]
+            # raise any errors from the threads
+            for f in futures:
+                f.result()
+
+
+def _stencil_context(x, p, n, phi, order, eps, chunk_size, workers):
+    '''
+    Finds the stencils for the target points `x` and factors the RBF-FD system
+    for each stencil. This is everything needed to compute the weights which
+    does not depend on the differential operator.
+
+    Returns
+    -------
+    stencils : (N, n) int array
+        Indices of the points in `p` making up each stencil
+
+    s : (N, n, D) float array
+        Stencils centered on their target points
+
+    pwr : (P, D) int array
+        Powers for the added monomials
+
+    fac : (N, n + P, n + P) float array
+        LDL^T factors of the RBF-FD systems
+
+    ipiv : (N, n + P) int array
+        Pivot indices for the factorizations
+
+    '''
+    nx, ndim = x.shape
+    _, stencils = KDTree(p).query(x, n)
+    # center the stencils on `x` for improved numerical stability
+    s = p[stencils] - x[:, None, :]
+    pwr = monomial_powers(order, ndim)
+    size = n + pwr.shape[0]
+    fac = np.empty((nx, size, size), dtype=float)
+    ipiv = np.empty((nx, size), dtype=np.intc)
+
+    def fill(start, stop):
+        LHS = _lhs(s[start:stop], phi, pwr, eps)
+        # `LHS` is symmetric, so it is factored with a compiled LDL^T kernel.
+        # The factors are stored rather than the inverse, which would be
+        # inaccurate for ill-conditioned systems.
+        fac[start:stop], ipiv[start:stop] = symmetric_factor(LHS)
+
+    _map_chunks(fill, nx, chunk_size, workers)
+    return stencils, s, pwr, fac, ipiv
+
+
+_cached_stencil_context = _MemoizeFD(_stencil_context)
+
+
+def _term_weights(x, p, n, diffs, phi, order, eps, chunk_size, workers):
+    '''
+    Returns the stencils and the RBF-FD weights for each term in `diffs`, with
+    coefficients of one. The weights are linear in the coefficients, so these
+    can be scaled and summed to get the weights for any coefficients.
+
+    Returns
+    -------
+    stencils : (N, n) int array
+        Indices of the points in `p` making up each stencil
+
+    w : (K, N, n) float array
+        RBF-FD weights for each term
+
+    '''
+    stencils, s, pwr, fac, ipiv = _cached_stencil_context(
+        x, p, n, phi, order, eps, chunk_size=chunk_size, workers=workers
+        )
+    w = np.empty((diffs.shape[0], x.shape[0], n), dtype=float)
+
+    def fill(start, stop):
+        rhs = _rhs(s[start:stop], phi, pwr, eps, diffs)
+        out = symmetric_solve(fac[start:stop], ipiv[start:stop], rhs)
+        w[:, start:stop] = np.moveaxis(out[:, :n], -1, 0)
+
+    _map_chunks(fill, x.shape[0], chunk_size, workers)
+    return stencils, w
+
+
+_cached_term_weights = _MemoizeFD(_term_weights)
+
+
+def _array_modules(a):
+    '''
+    Returns the array and sparse matrix modules for `a`, which is either a
+    numpy array or a cupy array
+    '''
+    if isinstance(a, np.ndarray):
+        return np, sp
+    else:
+        return _fd_core_cuda.cp, _fd_core_cuda.cpsp
+
+
+def _cuda_weights(x, p, stencils, diffs, coeffs, phi, order, eps, sum_terms,
+                  chunk_size):
+    '''
+    Returns the RBF-FD weights for `_weight_matrix_data` as a cupy array. The
+    RBF-FD systems are built on the host in chunks and each chunk is solved
+    on the CUDA device in one batch.
+    '''
+    nx, n = stencils.shape
+    ndim = x.shape[1]
+    if chunk_size is None:
+        chunk_size = max(nx, 1)
+
+    phi = get_rbf(phi)
+    order = _resolve_order(order, diffs, n, ndim)
+    pwr = monomial_powers(order, ndim)
+    if sum_terms:
+        data = _fd_core_cuda.empty((nx, n))
+    else:
+        data = _fd_core_cuda.empty((len(diffs), nx, n))
+
+    for start in range(0, nx, chunk_size):
+        stop = start + chunk_size
+        # center the stencils on `x` for improved numerical stability
+        s = p[stencils[start:stop]] - x[start:stop, None]
+        LHS = _lhs(s, phi, pwr, eps)
+        rhs = _rhs(s, phi, pwr, eps, diffs)
+        rhs *= coeffs[:, start:stop].T[:, None, :]
+        if sum_terms:
+            rhs = rhs.sum(axis=-1, keepdims=True)
+
+        w = _fd_core_cuda.batched_solve(LHS, rhs)[:, :n, :]
+        if sum_terms:
+            data[start:stop] = w[..., 0]
+        else:
+            data[:, start:stop] = w.transpose(2, 0, 1)
+
+    return data
+
+
+def _sum_groups(w, idx, coeffs, groups):
+    '''
+    Returns the sum of the weights for the terms in each group. `w` is a
+    (U, N, n) array of weights with coefficients of one, `idx` maps each of
+    the K terms to its weights in `w`, `coeffs` is a (K, N) array of
+    coefficients, and `groups` is a sequence of G arrays of term indices. This
+    returns a (G, N, n) array, which is a cupy array if `w` is.
+    '''
+    xp, _ = _array_modules(w)
+    out = xp.empty((len(groups),) + w.shape[1:], dtype=float)
+    for i, group in enumerate(groups):
+        # combine the coefficients for terms in the group with the same
+        # derivative, so that each of their weights is only scaled once
+        gdiffs, gidx = np.unique(idx[group], return_inverse=True)
+        gcoeffs = np.zeros((len(gdiffs), w.shape[1]), dtype=float)
+        np.add.at(gcoeffs, gidx.reshape(-1), coeffs[group])
+        if xp is not np:
+            gdiffs = xp.asarray(gdiffs)
+            gcoeffs = xp.asarray(gcoeffs)
+
+        out[i] = xp.einsum('ij,ijk->jk', gcoeffs, w[gdiffs])
+
+    return out
+
+
+def _weight_matrix_data(x, p, n, diffs, coeffs, phi, order, eps, sum_terms,
+                        sum_groups, chunk_size, cache, workers, dtype, device):
+    '''
+    Returns the stencils and the RBF-FD weights for `weight_matrix`. See
+    `weight_matrix` for a description of the arguments.
+
+    Returns
+    -------
+    stencils : (N, n) int array
+        Indices of the points in `p` making up each stencil
+
+    data : (N, n), (K, N, n), or (G, N, n) float array
+        RBF-FD weights for each stencil
+
+    shape : tuple
+        Shape of the weight matrices
+
+    The stencils and weights are cupy arrays if `device` is 'cuda'.
+
+    '''
+    if device == 'cuda':
+        _fd_core_cuda.check_cupy()
+    elif device != 'cpu':
+        raise ValueError('`device` must be "cpu" or "cuda".')
+
+    x = np.asarray(x, dtype=float)
+    assert_shape(x, (None, None), 'x')
+    nx, ndim = x.shape
+
+    p = np.asarray(p, dtype=float)
+    assert_shape(p, (None, ndim), 'p')
+
+    diffs = np.asarray(diffs, dtype=int)
+    diffs = np.atleast_2d(diffs)
+    assert_shape(diffs, (None, ndim), 'diffs')
+    nterms = diffs.shape[0]
+
+    if coeffs is None:
+        coeffs = np.ones(nterms, dtype=float)
+    else:
+        coeffs = _pack_coeffs(coeffs)
+        assert_shape(coeffs, (nterms, ...), 'coeffs')
+
+    if coeffs.ndim == 1:
+        coeffs = coeffs[:, None]
+
+    coeffs = np.broadcast_to(coeffs, (nterms, nx))
+
+    # The terms are summed within each group. Returning the sum of all terms
+    # and returning each term are the special cases of one group and of one
+    # group per term.
+    if sum_groups is not None:
+        groups = [np.asarray(g, dtype=int).reshape(-1) for g in sum_groups]
+    elif sum_terms:
+        groups = [np.arange(nterms)]
+    else:
+        groups = list(np.arange(nterms)[:, None])
+
+    if cache and (device == 'cpu'):
+        phi = get_rbf(phi)
+        order = _resolve_order(order, diffs, n, ndim)
+        # Terms with the same derivative have weights that only differ by
+        # their coefficients, so only compute weights for the unique
+        # derivatives
+        udiffs, idx = np.unique(diffs, axis=0, return_inverse=True)
+        idx = idx.reshape(-1)
+        stencils, w = _cached_term_weights(
+            x, p, n, udiffs, phi, order, eps, chunk_size=chunk_size,
+            workers=workers
+            )
+        # the sparse matrices may reference `stencils`, so copy it to protect
+        # the cache from modifications
+        stencils = stencils.copy()
+        # only the coefficients need to be applied to the cached weights
+        data = _sum_groups(w, idx, coeffs, groups)
+
+    elif (sum_groups is None) and sum_terms:
+        # combine the coefficients for terms with the same derivative, so that
+        # each system is solved for a single right-hand-side
+        diffs, idx = np.unique(diffs, axis=0, return_inverse=True)
+        ucoeffs = np.zeros((len(diffs), nx), dtype=float)
+        np.add.at(ucoeffs, idx.reshape(-1), coeffs)
+        coeffs = ucoeffs
+
+        _, stencils = KDTree(p).query(x, n)
+        if device == 'cuda':
+            data = _cuda_weights(
+                x, p, stencils, diffs, coeffs, phi, order, eps, True,
+                chunk_size
+                )[None]
+
+        else:
+            data = np.empty((1, nx, n), dtype=float)
+
+            def fill(start, stop):
+                data[0, start:stop] = weights(
+                    x[start:stop], p[stencils[start:stop]], diffs,
+                    coeffs=coeffs[:, start:stop],
+                    phi=phi,
+                    order=order,
+                    eps=eps
+                    )
+
+            _map_chunks(fill, nx, chunk_size, workers)
+
+    else:
+        # only compute weights for the unique derivatives, and then apply the
+        # coefficients for each group
+        udiffs, idx = np.unique(diffs, axis=0, return_inverse=True)
+        idx = idx.reshape(-1)
+        _, stencils = KDTree(p).query(x, n)
+        if device == 'cuda':
+            w = _cuda_weights(
+                x, p, stencils, udiffs, np.ones((len(udiffs), nx)), phi,
+                order, eps, False, chunk_size
+                )
+            data = _sum_groups(w, idx, coeffs, groups)
+
+        else:
+            data = np.empty((len(groups), nx, n), dtype=float)
+
+            def fill(start, stop):
+                w = weights(
+                    x[start:stop], p[stencils[start:stop]], udiffs,
+                    phi=phi,
+                    order=order,
+                    eps=eps,
+                    sum_terms=False
+                    )
+                data[:, start:stop] = _sum_groups(
+                    w, idx, coeffs[:, start:stop], groups
+                    )
+
+            _map_chunks(fill, nx, chunk_size, workers)
+
+    if device == 'cuda':
+        stencils = _fd_core_cuda.to_device(stencils)
+
+    if (sum_groups is None) and sum_terms:
+        data = data[0]
+
+    # the weights are always computed in double precision and only the output
+    # is converted to `dtype`
+    data = data.astype(dtype, copy=False)
+    return stencils, data, (nx, len(p))
+
+
 def weight_matrix(x, p, n, diffs,
                   coeffs=None,
                   phi='phs3',
                   order=None,
                   eps=1.0,
                   sum_terms=True,
-                  chunk_size=1000):
+                  sum_groups=None,
+                  chunk_size=1000,
+                  cache=False,
+                  workers=1,
+                  dtype=float,
+                  device='cpu'):
     '''
     Returns a weight matrix which maps a function's values at `p` to an
     approximation of that function's derivative at `x`. This is a convenience
@@ -212,8 +653,9 @@ def weight_matrix(x, p, n, diffs,
 
     coeffs : (K,) or (K, N) float array, optional
         Coefficients for each term in the differential operator specified with
-        `diffs`. The coefficients can vary between target points. Defaults to
-        an array of ones.
+        `diffs`. The coefficients can vary between target points. This can
+        also be a sequence with a scalar or an (N,) array for each term.
+        Defaults to an array of ones.
 
     phi : rbf.basis.RBF instance or str, optional
         Type of RBF. Select from those available in `rbf.basis` or create your
@@ -231,13 +673,53 @@ def weight_matrix(x, p, n, diffs,
         If `False`, a matrix will be returned for each term in `diffs` rather
         than their sum.
 
+    sum_groups : sequence of int sequences, optional
+        Groups of indices of terms in `diffs`. If this is given, a matrix is
+        returned for each group that is the sum of the terms in that group,
+        and `sum_terms` is ignored. For example, `[(0, 1), (2,)]` returns the
+        sum of the first two terms and the third term. The groups are summed
+        as the weights are computed, which is cheaper than adding the matrices
+        for the individual terms.
+
     chunk_size : int, optional
         Break the target points into chunks with this size to reduce the memory
         requirements
 
+    cache : bool, optional
+        If `True`, the stencils and the factored RBF-FD systems are cached and
+        reused by subsequent calls with the same `x`, `p`, `n`, `phi`, `order`,
+        and `eps`, which makes those calls much cheaper. The weights for each
+        term in `diffs` are also cached, so that subsequent calls which only
+        change `coeffs` just need to rescale them. This requires storing an
+        (N, n + P, n + P) array, where P is the number of added monomials, and
+        a (K, N, n) array. The cache can be cleared with
+        `rbf.utils.clear_memoize_caches`.
+
+    workers : int, optional
+        Number of threads used to compute the weights for the chunks of target
+        points in parallel. If this is None, then it is set to the number of
+        CPUs.
+
+    dtype : data-type, optional
+        Data type of the returned matrices. The weights are computed in double
+        precision regardless of `dtype`. Using `np.float32` halves the memory
+        of the matrices and speeds up matrix-vector products, which is useful
+        for iterative solvers with loose tolerances. This is only safe when
+        the RBF-FD systems are reasonably well-conditioned (e.g., small
+        stencils with polyharmonic splines), since the rounding error is
+        amplified by the magnitude of the weights.
+
+    device : str, optional
+        Either 'cpu' or 'cuda'. If this is 'cuda', then the RBF-FD systems are
+        solved on the current CUDA device with CuPy, and the returned matrices
+        are `cupyx.scipy.sparse` matrices residing on that device. The
+        stencils and the RBF-FD systems are still built on the CPU, and
+        `cache` and `workers` are ignored.
+
     Returns
     -------
-    (N, M) coo sparse matrix or K-tuple of (N, M) coo sparse matrices
+    (N, M) coo sparse matrix, K-tuple of (N, M) coo sparse matrices, or
+    G-tuple of (N, M) coo sparse matrices
 
     Examples
     --------
@@ -252,65 +734,60 @@ def weight_matrix(x, p, n, diffs,
            [ 0.,  1., -2., 1.]])
 
     '''
-    x = np.asarray(x, dtype=float)
-    assert_shape(x, (None, None), 'x')
-    nx, ndim = x.shape
-
-    p = np.asarray(p, dtype=float)
-    assert_shape(p, (None, ndim), 'p')
+    stencils, data, shape = _weight_matrix_data(
+        x, p, n, diffs, coeffs, phi, order, eps, sum_terms, sum_groups,
+        chunk_size, cache, workers, dtype, device
+        )
+    xp, xsp = _array_modules(data)
+    nx, n = stencils.shape
+    rows = xp.repeat(xp.arange(nx), n)
+    cols = stencils.ravel()
+    if (sum_groups is None) and sum_terms:
+        data = data.ravel()
+        out = xsp.coo_matrix((data, (rows, cols)), shape)
+    else:
+        data = data.reshape(data.shape[0], -1)
+        out = tuple(xsp.coo_matrix((d, (rows, cols)), shape) for d in data)
 
-    diffs = np.asarray(diffs, dtype=int)
-    diffs = np.atleast_2d(diffs)
-    assert_shape(diffs, (None, ndim), 'diffs')
-    nterms = diffs.shape[0]
+    return out
 
-    if coeffs is None:
-        coeffs = np.ones(nterms, dtype=float)
-    else:
-        coeffs = np.asarray(coeffs, dtype=float)
-        assert_shape(coeffs, (nterms, ...), 'coeffs')
 
-    if coeffs.ndim == 1:
-        coeffs = coeffs[:, None]
+_SharedCSR = namedtuple('_SharedCSR', ['indptr', 'indices', 'data', 'shape'])
 
-    coeffs = np.broadcast_to(coeffs, (nterms, nx))
 
-    _, stencils = KDTree(p).query(x, n)
-    if chunk_size is None:
-        data = weights(
-            x, p[stencils], diffs,
-            coeffs=coeffs,
-            phi=phi,
-            order=order,
-            eps=eps,
-            sum_terms=sum_terms
-            )
-    else:
-        if sum_terms:
-            data = np.empty((nx, n), dtype=float)
-        else:
-            data = np.empty((nterms, nx, n), dtype=float)
-
-        for start in range(0, nx, chunk_size):
-            stop = start + chunk_size
-            data[..., start:stop, :] = weights(
-                x[start:stop], p[stencils[start:stop]], diffs,
-                coeffs=coeffs[:, start:stop],
-                phi=phi,
-                order=order,
-                eps=eps,
-                sum_terms=sum_terms
-                )
+def _shared_weight_matrix(x, p, n, diffs,
+                          coeffs=None,
+                          phi='phs3',
+                          order=None,
+                          eps=1.0,
+                          sum_groups=None,
+                          chunk_size=1000,
+                          cache=False,
+                          workers=1,
+                          dtype=float,
+                          device='cpu'):
+    '''
+    Returns the weight matrices for each term in `diffs`, or for each group in
+    `sum_groups`, in a CSR format where the matrices share one `indptr` and
+    `indices` array. The matrices all use the same stencils, so only their
+    data differs. See `weight_matrix` for a description of the arguments.
 
-    rows = np.repeat(range(nx), n)
-    cols = stencils.ravel()
-    if sum_terms:
-        data = data.ravel()
-        out = sp.coo_matrix((data, (rows, cols)), (nx, len(p)))
-    else:
-        data = data.reshape(nterms, -1)
-        out = tuple(
-            sp.coo_matrix((d, (rows, cols)), (nx, len(p))) for d in data
-            )
+    Returns
+    -------
+    _SharedCSR
+        Named tuple with `indptr`, `indices`, a (K, N*n) or (G, N*n) `data`
+        array, and the `shape` of each matrix. The arrays are cupy arrays if
+        `device` is 'cuda'.
 
+    '''
+    stencils, data, shape = _weight_matrix_data(
+        x, p, n, diffs, coeffs, phi, order, eps, False, sum_groups,
+        chunk_size, cache, workers, dtype, device
+        )
+    xp, _ = _array_modules(data)
+    nx, n = stencils.shape
+    indptr = xp.arange(0, nx*n + 1, n)
+    indices = stencils.ravel()
+    data = data.reshape(data.shape[0], -1)
+    out = _SharedCSR(indptr, indices, data, shape)
     return out
@@ -29,6 +29,7 @@ if __name__ == '__main__':
     ext += [Extension(name='rbf.pde.halton', sources=['rbf/pde/halton.c'])]
     ext += [Extension(name='rbf.pde.geometry', sources=['rbf/pde/geometry.c'])]
     ext += [Extension(name='rbf.pde.sampling', sources=['rbf/pde/sampling.c'])]
+    ext += [Extension(name='rbf.pde._fd_core', sources=['rbf/pde/_fd_core.c'])]
 
     with open('rbf/_rbf_ufuncs/metadata.json', 'r') as f:
         rbf_ufunc_metadata = json.load(f)
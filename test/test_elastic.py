@@ -0,0 +1,216 @@
+import numpy as np
+import scipy.sparse as sp
+import rbf.pde.elastic as el
+import rbf.pde.fd
+import rbf.pde.halton
+import unittest
+
+def stack(out, dim):
+  comps = 'xyz'[:dim]
+  return sp.bmat([[out[i + j] for j in comps] for i in comps]).toarray()
+
+def check_components(test, out, terms, x, p, n):
+  # compare each component in `out` to a separate call to `weight_matrix`
+  # with the derivatives and coefficients in `terms`
+  test.assertEqual(set(out), set(terms))
+  for k, (diffs, coeffs) in terms.items():
+    D = rbf.pde.fd.weight_matrix(x, p, n, diffs, coeffs=coeffs)
+    test.assertTrue(np.allclose(out[k].toarray(), D.toarray()))
+
+class Test(unittest.TestCase):
+  def test_2d_block(self):
+    # the block matrices should be the same as stacking the components
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    p = rbf.pde.halton.halton_sequence(80, 2)
+    nrm = np.random.normal(0.0, 1.0, (50, 2))
+
+    out = el.elastic2d_body_force(x, p, 10, lamb=2.0, mu=0.5)
+    D = el.elastic2d_body_force_block(x, p, 10, lamb=2.0, mu=0.5)
+    self.assertTrue(np.allclose(D.toarray(), stack(out, 2)))
+
+    out = el.elastic2d_surface_force(x, nrm, p, 10, lamb=2.0, mu=0.5)
+    D = el.elastic2d_surface_force_block(x, nrm, p, 10, lamb=2.0, mu=0.5)
+    self.assertTrue(np.allclose(D.toarray(), stack(out, 2)))
+
+  def test_3d_block(self):
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    p = rbf.pde.halton.halton_sequence(80, 3)
+    nrm = np.random.normal(0.0, 1.0, (50, 3))
+
+    out = el.elastic3d_body_force(x, p, 20, lamb=2.0, mu=0.5)
+    D = el.elastic3d_body_force_block(x, p, 20, lamb=2.0, mu=0.5)
+    self.assertTrue(np.allclose(D.toarray(), stack(out, 3)))
+
+    out = el.elastic3d_surface_force(x, nrm, p, 20, lamb=2.0, mu=0.5)
+    D = el.elastic3d_surface_force_block(x, nrm, p, 20, lamb=2.0, mu=0.5)
+    self.assertTrue(np.allclose(D.toarray(), stack(out, 3)))
+
+  def test_cached_coefficients(self):
+    # changing the Lame parameters should reuse the cached weights and give
+    # the same matrices as building them from scratch
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    for lamb in [1.0, 3.0]:
+      out1 = el.elastic2d_body_force(x, x, 10, lamb=lamb, mu=0.5, cache=True)
+      out2 = el.elastic2d_body_force(x, x, 10, lamb=lamb, mu=0.5, cache=False)
+      for k in out1:
+        self.assertTrue(np.allclose(out1[k].toarray(), out2[k].toarray()))
+
+  def test_single_precision(self):
+    # the single precision matrices should be the double precision matrices
+    # rounded to float32
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    out1 = el.elastic3d_body_force(x, x, 20, lamb=2.0, mu=0.5)
+    out2 = el.elastic3d_body_force(x, x, 20, lamb=2.0, mu=0.5,
+                                   dtype=np.float32)
+    for k in out1:
+      self.assertEqual(out2[k].dtype, np.float32)
+      A1, A2 = out1[k].toarray(), out2[k].toarray()
+      self.assertTrue(np.allclose(A1, A2, atol=1e-6*np.abs(A1).max()))
+
+    D = el.elastic3d_body_force_block(x, x, 20, lamb=2.0, mu=0.5,
+                                      dtype=np.float32)
+    self.assertEqual(D.dtype, np.float32)
+    A1 = stack(out1, 3)
+    self.assertTrue(np.allclose(D.toarray(), A1, atol=1e-6*np.abs(A1).max()))
+
+  def test_displacement_identity(self):
+    # interpolating at the observation points should give identity matrices,
+    # which are returned without building the stencils
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    out = el.elastic2d_displacement(x, x.copy(), 10)
+    D = rbf.pde.fd.weight_matrix(x, x, 10, (0, 0))
+    for k in ['xx', 'yy']:
+      self.assertTrue(np.allclose(out[k].toarray(), D.toarray()))
+
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    p = rbf.pde.halton.halton_sequence(80, 3)
+    out = el.elastic3d_displacement(x, x, 20, dtype=np.float32)
+    for k in ['xx', 'yy', 'zz']:
+      self.assertEqual(out[k].dtype, np.float32)
+      self.assertTrue(np.allclose(out[k].toarray(), np.eye(50)))
+
+    out = el.elastic3d_displacement(x, p, 20)
+    D = rbf.pde.fd.weight_matrix(x, p, 20, (0, 0, 0))
+    for k in ['xx', 'yy', 'zz']:
+      self.assertTrue(np.allclose(out[k].toarray(), D.toarray()))
+
+  def test_displacement_identity_arguments(self):
+    # the arguments should be checked the same way as in `weight_matrix` when
+    # the identity matrices are returned
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    self.assertRaises(ValueError, el.elastic2d_displacement, x, x, 100)
+    self.assertRaises(
+      ValueError, el.elastic2d_displacement, x, x, 10, device='gpu'
+      )
+    self.assertRaises(ValueError, el.elastic2d_displacement, x, x, 3, order=2)
+    self.assertRaises(
+      ValueError, el.elastic2d_displacement, x, x, 10, phi='foo'
+      )
+    self.assertRaises(
+      TypeError, el.elastic2d_displacement, x, x, 10, chunksize=100
+      )
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    self.assertRaises(ValueError, el.elastic3d_displacement, x, x, 100)
+    self.assertRaises(
+      TypeError, el.elastic3d_displacement, x, x, 10, chunksize=100
+      )
+
+  def test_varying_lame_parameters(self):
+    # the Lame parameters can be arrays with a value for each target point
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    nrm = np.random.normal(0.0, 1.0, (50, 3))
+    lamb = np.full(50, 2.0)
+    out1 = el.elastic3d_body_force(x, x, 20, lamb=lamb, mu=0.5)
+    out2 = el.elastic3d_body_force(x, x, 20, lamb=2.0, mu=0.5)
+    for k in out1:
+      self.assertTrue(np.allclose(out1[k].toarray(), out2[k].toarray()))
+
+    out1 = el.elastic3d_surface_force(x, nrm, x, 20, lamb=lamb, mu=0.5)
+    out2 = el.elastic3d_surface_force(x, nrm, x, 20, lamb=2.0, mu=0.5)
+    for k in out1:
+      self.assertTrue(np.allclose(out1[k].toarray(), out2[k].toarray()))
+
+  def test_component_format(self):
+    # the components should have the same sparse formats as when they were
+    # built with separate calls to `weight_matrix`. The 2D components that
+    # are the sum of multiple terms are CSR and the others are COO.
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    nrm = np.random.normal(0.0, 1.0, (50, 2))
+    out = el.elastic2d_body_force(x, x, 10)
+    for k in ['xx', 'yy']:
+      self.assertTrue(sp.isspmatrix_csr(out[k]))
+
+    for k in ['xy', 'yx']:
+      self.assertTrue(sp.isspmatrix_coo(out[k]))
+
+    out = el.elastic2d_surface_force(x, nrm, x, 10)
+    for D in out.values():
+      self.assertTrue(sp.isspmatrix_csr(D))
+
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    nrm = np.random.normal(0.0, 1.0, (50, 3))
+    out = el.elastic3d_body_force(x, x, 20)
+    out.update(el.elastic3d_surface_force(x, nrm, x, 20))
+    for D in out.values():
+      self.assertTrue(sp.isspmatrix_coo(D))
+
+  def test_reference_components(self):
+    # each component should match a separate call to `weight_matrix` with the
+    # terms for that component
+    l, m = 2.0, 0.5
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    p = rbf.pde.halton.halton_sequence(80, 2)
+    nrm = np.random.normal(0.0, 1.0, (50, 2))
+    nx, ny = nrm[:, 0], nrm[:, 1]
+    body = {
+      'xx': ([(2, 0), (0, 2)], [l + 2*m, m]),
+      'xy': ([(1, 1)], [l + m]),
+      'yx': ([(1, 1)], [l + m]),
+      'yy': ([(0, 2), (2, 0)], [l + 2*m, m])}
+    surface = {
+      'xx': ([(1, 0), (0, 1)], [nx*(l + 2*m), ny*m]),
+      'xy': ([(0, 1), (1, 0)], [nx*l, ny*m]),
+      'yx': ([(0, 1), (1, 0)], [nx*m, ny*l]),
+      'yy': ([(1, 0), (0, 1)], [nx*m, ny*(l + 2*m)])}
+    check_components(
+      self, el.elastic2d_body_force(x, p, 10, lamb=l, mu=m), body, x, p, 10
+      )
+    check_components(
+      self, el.elastic2d_surface_force(x, nrm, p, 10, lamb=l, mu=m),
+      surface, x, p, 10
+      )
+
+    x = rbf.pde.halton.halton_sequence(50, 3)
+    p = rbf.pde.halton.halton_sequence(80, 3)
+    nrm = np.random.normal(0.0, 1.0, (50, 3))
+    nx, ny, nz = nrm[:, 0], nrm[:, 1], nrm[:, 2]
+    body = {
+      'xx': ([(2, 0, 0), (0, 2, 0), (0, 0, 2)], [l + 2*m, m, m]),
+      'xy': ([(1, 1, 0)], [l + m]),
+      'xz': ([(1, 0, 1)], [l + m]),
+      'yx': ([(1, 1, 0)], [l + m]),
+      'yy': ([(2, 0, 0), (0, 2, 0), (0, 0, 2)], [m, l + 2*m, m]),
+      'yz': ([(0, 1, 1)], [l + m]),
+      'zx': ([(1, 0, 1)], [l + m]),
+      'zy': ([(0, 1, 1)], [l + m]),
+      'zz': ([(2, 0, 0), (0, 2, 0), (0, 0, 2)], [m, m, l + 2*m])}
+    surface = {
+      'xx': ([(1, 0, 0), (0, 1, 0), (0, 0, 1)],
+             [nx*(l + 2*m), ny*m, nz*m]),
+      'xy': ([(0, 1, 0), (1, 0, 0)], [nx*l, ny*m]),
+      'xz': ([(0, 0, 1), (1, 0, 0)], [nx*l, nz*m]),
+      'yx': ([(0, 1, 0), (1, 0, 0)], [nx*m, ny*l]),
+      'yy': ([(1, 0, 0), (0, 1, 0), (0, 0, 1)],
+             [nx*m, ny*(l + 2*m), nz*m]),
+      'yz': ([(0, 0, 1), (0, 1, 0)], [ny*l, nz*m]),
+      'zx': ([(0, 0, 1), (1, 0, 0)], [nx*m, nz*l]),
+      'zy': ([(0, 0, 1), (0, 1, 0)], [ny*m, nz*l]),
+      'zz': ([(1, 0, 0), (0, 1, 0), (0, 0, 1)],
+             [nx*m, ny*m, nz*(l + 2*m)])}
+    check_components(
+      self, el.elastic3d_body_force(x, p, 20, lamb=l, mu=m), body, x, p, 20
+      )
+    check_components(
+      self, el.elastic3d_surface_force(x, nrm, p, 20, lamb=l, mu=m),
+      surface, x, p, 20
+      )
@@ -1,7 +1,11 @@
 import numpy as np
 import rbf.basis
 import rbf.pde.fd
+import rbf.pde._fd_core
+import rbf.pde._fd_core_cuda
+import rbf.pde.elastic
 import rbf.pde.halton
+import rbf.utils
 import unittest
 
 def test_func2d(x):
@@ -177,3 +181,172 @@ class Test(unittest.TestCase):
     w = rbf.pde.fd.weights(x,nodes,(0,1),
                        phi=rbf.basis.phs8)
     self.assertTrue(np.isclose(u.dot(w),diff_true,atol=1e-2))
+
+  def test_weight_matrix_cache(self):
+    # the cached weight matrices should be the same as the uncached ones,
+    # including when the cached context is reused
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(200)
+    diffs = [(2,0),(0,2),(1,1)]
+    coeffs = [np.linspace(1.0,2.0,100), np.full(100,3.0), np.full(100,-1.0)]
+    x = nodes[:100]
+    W1 = rbf.pde.fd.weight_matrix(x,nodes,10,diffs,coeffs=coeffs,
+                                  chunk_size=30)
+    for _ in range(2):
+      W2 = rbf.pde.fd.weight_matrix(x,nodes,10,diffs,coeffs=coeffs,
+                                    chunk_size=30,cache=True)
+      self.assertTrue(np.allclose(W1.toarray(),W2.toarray()))
+
+    W1 = rbf.pde.fd.weight_matrix(x,nodes,10,diffs,sum_terms=False)
+    W2 = rbf.pde.fd.weight_matrix(x,nodes,10,diffs,sum_terms=False,
+                                  cache=True)
+    for w1, w2 in zip(W1, W2):
+      self.assertTrue(np.allclose(w1.toarray(),w2.toarray()))
+
+  def test_weight_matrix_cache_options(self):
+    # the chunk size and number of workers do not change the weights, so
+    # they should not create new cache entries
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    rbf.utils.clear_memoize_caches()
+    for chunk_size, workers in [(1000,1),(30,1),(30,2)]:
+      rbf.pde.fd.weight_matrix(nodes,nodes,10,(1,0),chunk_size=chunk_size,
+                               workers=workers,cache=True)
+
+    self.assertEqual(len(rbf.pde.fd._cached_stencil_context.cache),1)
+    self.assertEqual(len(rbf.pde.fd._cached_term_weights.cache),1)
+
+  def test_weight_matrix_cache_smooth_rbf(self):
+    # the cached weights should be as accurate as the uncached weights for
+    # smooth RBFs, which have ill-conditioned RBF-FD systems
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(500)
+    u = np.sin(2*nodes[:,0])*np.cos(3*nodes[:,1])
+    for phi in ['ga', 'imq']:
+      for cache in [False, True]:
+        W = rbf.pde.fd.weight_matrix(nodes,nodes,30,[(2,0),(0,2)],phi=phi,
+                                     eps=0.5,cache=cache)
+        err = np.abs(W.dot(u) + 13*u).max()
+        self.assertLess(err, 1.0)
+
+  def test_weight_matrix_workers(self):
+    # computing the chunks in parallel should not change the weights
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(200)
+    W1 = rbf.pde.fd.weight_matrix(nodes,nodes,10,[(2,0),(0,2)],
+                                  chunk_size=30)
+    for cache in [False, True]:
+      W2 = rbf.pde.fd.weight_matrix(nodes,nodes,10,[(2,0),(0,2)],
+                                    chunk_size=30,cache=cache,workers=3)
+      self.assertTrue(np.allclose(W1.toarray(),W2.toarray()))
+
+  def test_weight_matrix_duplicate_terms(self):
+    # duplicated terms are only computed once, but they should still be
+    # returned for each term
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    diffs = [(2,0),(1,1),(2,0),(1,1)]
+    coeffs = [2.0,1.0,2.0,3.0]
+    for cache in [False, True]:
+      W = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                   sum_terms=False,cache=cache)
+      for d, c, w in zip(diffs, coeffs, W):
+        w_true = rbf.pde.fd.weight_matrix(nodes,nodes,10,d,coeffs=[c])
+        self.assertTrue(np.allclose(w.toarray(),w_true.toarray()))
+
+      W = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                   cache=cache)
+      W_true = sum(w_true.toarray() for w_true in
+                   rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,
+                                            coeffs=coeffs,sum_terms=False))
+      self.assertTrue(np.allclose(W.toarray(),W_true))
+
+  def test_symmetric_solve(self):
+    # the compiled LDL^T solver should agree with numpy for symmetric
+    # indefinite systems
+    np.random.seed(1)
+    A = np.random.random((20,8,8))
+    A = A + A.transpose(0,2,1)
+    A[:,6:,6:] = 0.0
+    b = np.random.random((20,8,3))
+    fac, ipiv = rbf.pde._fd_core.symmetric_factor(A)
+    x = rbf.pde._fd_core.symmetric_solve(fac,ipiv,b)
+    self.assertTrue(np.allclose(x,np.linalg.solve(A,b)))
+    # mismatched shapes should be caught before the unchecked loop
+    with self.assertRaises(ValueError):
+      rbf.pde._fd_core.symmetric_solve(fac[:10],ipiv,b)
+
+    with self.assertRaises(ValueError):
+      rbf.pde._fd_core.symmetric_solve(fac,ipiv,b[:,:6])
+
+  def test_batched_solve(self):
+    # the compiled solver should agree with numpy for broadcasted symmetric
+    # systems
+    np.random.seed(1)
+    A = np.random.random((4,1,8,8))
+    A = A + A.transpose(0,1,3,2)
+    b = np.random.random((3,8,2))
+    x = rbf.pde.fd._batched_solve(A,b)
+    self.assertTrue(np.allclose(x,np.linalg.solve(A,b)))
+
+  @unittest.skipIf(not rbf.pde._fd_core_cuda.HAS_CUPY,
+                   'cupy is not installed')
+  def test_weight_matrix_cuda(self):
+    # the weight matrices built on the GPU should agree with the CPU
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    diffs = [(2,0),(1,1),(0,2)]
+    coeffs = [2.0,1.0,3.0]
+    W1 = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs)
+    W2 = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                  device='cuda',chunk_size=30)
+    self.assertTrue(np.allclose(W1.toarray(),W2.get().toarray()))
+
+    W1 = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                  sum_terms=False)
+    W2 = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                  sum_terms=False,device='cuda',
+                                  chunk_size=None)
+    for w1, w2 in zip(W1, W2):
+      self.assertTrue(np.allclose(w1.toarray(),w2.get().toarray()))
+
+  @unittest.skipIf(not rbf.pde._fd_core_cuda.HAS_CUPY,
+                   'cupy is not installed')
+  def test_elastic_cuda(self):
+    # the elastic weight matrices built on the GPU should agree with the CPU
+    x = rbf.pde.halton.halton_sequence(50, 2)
+    p = rbf.pde.halton.halton_sequence(80, 2)
+    nrm = np.random.normal(0.0, 1.0, (50, 2))
+    funcs = [
+      lambda **kw: rbf.pde.elastic.elastic2d_body_force(x, p, 10, **kw),
+      lambda **kw: rbf.pde.elastic.elastic2d_surface_force(x, nrm, p, 10,
+                                                           **kw),
+      lambda **kw: rbf.pde.elastic.elastic2d_displacement(x, p, 10, **kw),
+      lambda **kw: rbf.pde.elastic.elastic2d_displacement(x, x, 10, **kw)]
+    for func in funcs:
+      out1 = func()
+      out2 = func(device='cuda')
+      for k in out1:
+        self.assertTrue(np.allclose(out1[k].toarray(),
+                                    out2[k].get().toarray()))
+
+    D1 = rbf.pde.elastic.elastic2d_body_force_block(x, p, 10)
+    D2 = rbf.pde.elastic.elastic2d_body_force_block(x, p, 10, device='cuda')
+    self.assertTrue(np.allclose(D1.toarray(),D2.get().toarray()))
+
+  def test_weight_matrix_sum_groups(self):
+    # each group should be the sum of the matrices for its terms
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    diffs = [(2,0),(0,2),(1,1),(2,0)]
+    coeffs = [2.0,1.0,3.0,4.0]
+    groups = [(0,1),(2,),(1,2,3)]
+    W_terms = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                       sum_terms=False)
+    for cache in [False, True]:
+      W = rbf.pde.fd.weight_matrix(nodes,nodes,10,diffs,coeffs=coeffs,
+                                   sum_groups=groups,cache=cache)
+      self.assertEqual(len(W), len(groups))
+      for g, w in zip(groups, W):
+        w_true = sum(W_terms[i].toarray() for i in g)
+        self.assertTrue(np.allclose(w.toarray(),w_true))